@@ -0,0 +1,53 @@
+import os
+import asyncio
+import functools
+import weakref
+from aiolimiter import AsyncLimiter
+from dotenv import load_dotenv
+from pyairtable import Api
+from pyairtable.formulas import match
+
+# Load environment variables from .env file, unless they are already set
+if not (os.getenv("AIRTABLE_API_KEY") and os.getenv("AIRTABLE_BASE_ID")):
+    load_dotenv()
+
+# --- SETUP ---
+AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
+AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
+
+if not all([AIRTABLE_API_KEY, AIRTABLE_BASE_ID]):
+    raise ValueError("API Key and Base ID must be set in the .env file.")
+
+# Single Airtable client; every table handle shares this Api's keep-alive session
+_api = Api(AIRTABLE_API_KEY)
+
+# Airtable allows 5 requests/sec per base, so never keep more than 5 in flight or start more than 5 a second
+AIRTABLE_CONCURRENCY = 5
+
+# Event loop -> (semaphore, rate limiter); both bind to the first loop that uses them, so each
+# asyncio.run gets its own pair
+_airtable_limits = weakref.WeakKeyDictionary()
+
+@functools.lru_cache(maxsize=None)
+def get_table(name: str):
+    """Returns the shared handle for a table in the configured base."""
+    return _api.table(AIRTABLE_BASE_ID, name)
+
+def _get_airtable_limits():
+    """Returns the Airtable semaphore and rate limiter for the running event loop."""
+    loop = asyncio.get_running_loop()
+    limits = _airtable_limits.get(loop)
+    if limits is None:
+        limits = _airtable_limits[loop] = (asyncio.Semaphore(AIRTABLE_CONCURRENCY), AsyncLimiter(5, 1))
+    return limits
+
+async def airtable_call(func, *args, **kwargs):
+    """Runs a blocking pyairtable call in a worker thread, within Airtable's rate limit."""
+    semaphore, rate_limit = _get_airtable_limits()
+    async with semaphore, rate_limit:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+async def fetch_applicant_record(applicant_id, fields):
+    """Fetches the requested fields of the Applicants record for an Applicant ID."""
+    formula = match({"Applicant ID": applicant_id})
+    return await airtable_call(get_table("Applicants").first, formula=formula, fields=fields)
\ No newline at end of file
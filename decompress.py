@@ -1,32 +1,96 @@
-import os
-import json
-from dotenv import load_dotenv
-from pyairtable import Api
-
-# Load environment variables from .env file
-load_dotenv()
+import asyncio
+import orjson
+from pyairtable.formulas import match
+from airtable_client import airtable_call, fetch_applicant_record, get_table
 
 # --- 1. SETUP ---
-AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
-AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
+PERSONAL_TABLE = get_table("Personal Details")
+EXPERIENCE_TABLE = get_table("Work Experience")
+SALARY_TABLE = get_table("Salary Preferences")
+
+# JSON section -> child table it is decompressed into
+CHILD_TABLES = {
+    "personal": PERSONAL_TABLE,
+    "experience": EXPERIENCE_TABLE,
+    "salary": SALARY_TABLE,
+}
+
+async def fetch_existing_child_records(applicant_id, sections):
+    """Looks up the applicant's existing records in each requested child table, concurrently."""
+    formula = match({"Applicant": applicant_id})
+    lookups = []
+    for section in sections:
+        if section == "experience":
+            # Full rows are needed to diff against the JSON
+            lookups.append(airtable_call(EXPERIENCE_TABLE.all, formula=formula))
+        else:
+            # Only the record ID is needed; one-to-one tables never hold more than one row
+            lookups.append(airtable_call(CHILD_TABLES[section].all, formula=formula, max_records=1, fields=["Applicant"]))
+    results = await asyncio.gather(*lookups)
+    return dict(zip(sections, results))
+
+async def upsert_one_to_one(table, label, existing_records, record_id, data):
+    """Updates the applicant's single row in a one-to-one child table, creating it if missing."""
+    data["Applicant"] = [record_id]
+    data.pop('Id', None)
+    if existing_records:
+        print(f"  > Updating {label}...")
+        await airtable_call(table.update, existing_records[0]['id'], data)
+    else:
+        print(f"  > Creating {label}...")
+        await airtable_call(table.create, data)
+
+def experience_key(fields):
+    """Identifies a job by (Company, Start) so rows can be matched across syncs."""
+    return (fields.get("Company"), fields.get("Start"))
 
-if not all([AIRTABLE_API_KEY, AIRTABLE_BASE_ID]):
-    raise ValueError("API Key and Base ID must be set in the .env file.")
+async def sync_work_experience(existing_records, record_id, experience_data):
+    """Diffs the applicant's Work Experience rows against the JSON and writes only the changes."""
+    existing_by_key = {}
+    for rec in existing_records:
+        existing_by_key.setdefault(experience_key(rec['fields']), []).append(rec)
 
-api = Api(AIRTABLE_API_KEY)
+    records_to_create = []
+    records_to_update = []
+    for exp in experience_data:
+        exp.pop('Id', None)
+        matches = existing_by_key.get(experience_key(exp))
+        if not matches:
+            exp["Applicant"] = [record_id]
+            records_to_create.append(exp)
+            continue
+
+        existing = matches.pop()
+        existing_fields = {k: v for k, v in existing['fields'].items() if k not in ("Applicant", "Id")}
+        if existing_fields != exp:
+            # Fields dropped from the JSON are cleared explicitly, since updates are merges
+            cleared = {k: None for k in existing_fields if k not in exp}
+            records_to_update.append({"id": existing['id'], "fields": {**exp, **cleared}})
+
+    record_ids_to_delete = [rec['id'] for matches in existing_by_key.values() for rec in matches]
+
+    if not (records_to_create or records_to_update or record_ids_to_delete):
+        print("  > Work Experience already up to date.")
+        return
 
-APPLICANTS_TABLE = api.table(AIRTABLE_BASE_ID, "Applicants")
-PERSONAL_TABLE = api.table(AIRTABLE_BASE_ID, "Personal Details")
-EXPERIENCE_TABLE = api.table(AIRTABLE_BASE_ID, "Work Experience")
-SALARY_TABLE = api.table(AIRTABLE_BASE_ID, "Salary Preferences")
+    writes = []
+    if record_ids_to_delete:
+        print(f"  > Deleting {len(record_ids_to_delete)} old Work Experience records...")
+        writes.append(airtable_call(EXPERIENCE_TABLE.batch_delete, record_ids_to_delete))
+    if records_to_update:
+        print(f"  > Updating {len(records_to_update)} Work Experience records...")
+        writes.append(airtable_call(EXPERIENCE_TABLE.batch_update, records_to_update))
+    if records_to_create:
+        print(f"  > Creating {len(records_to_create)} new Work Experience records...")
+        writes.append(airtable_call(EXPERIENCE_TABLE.batch_create, records_to_create))
+    await asyncio.gather(*writes)
 
-def decompress_applicant_data(applicant_id_to_process: str):
+async def decompress_applicant_data(applicant_id_to_process: str):
     """Reads compressed JSON and upserts data into child tables."""
     print(f"Decompressing data for Applicant ID: {applicant_id_to_process}...")
 
     # --- 2. FETCH AND PARSE JSON ---
-    formula = f"{{Applicant ID}} = '{applicant_id_to_process}'"
-    applicant_record = APPLICANTS_TABLE.first(formula=formula)
+    applicant_record = await fetch_applicant_record(applicant_id_to_process, ["Compressed JSON"])
     if not applicant_record:
         print(f"Error: Applicant with ID '{applicant_id_to_process}' not found.")
         return
@@ -34,58 +98,53 @@ def decompress_applicant_data(applicant_id_to_process: str):
     record_id = applicant_record['id']
     try:
         compressed_json_str = applicant_record['fields']['Compressed JSON']
-        applicant_data = json.loads(compressed_json_str)
-    except (KeyError, json.JSONDecodeError):
+        applicant_data = orjson.loads(compressed_json_str)
+    except (KeyError, orjson.JSONDecodeError):
         print(f"Error: Could not read or parse JSON for Applicant ID {applicant_id_to_process}.")
         return
 
+    # Look up existing child records once, for only the sections present in the JSON
+    sections = [section for section in CHILD_TABLES if applicant_data.get(section)]
+    existing_records = await fetch_existing_child_records(applicant_id_to_process, sections)
+
+    # The three child tables are independent, so sync them concurrently
+    tasks = []
+
     # --- 3. UPSERT PERSONAL DETAILS (One-to-One) ---
     personal_data = applicant_data.get("personal", {})
     if personal_data:
-        personal_record = PERSONAL_TABLE.first(formula=f"{{Applicant}} = '{applicant_id_to_process}'")
-        personal_data["Applicant"] = [record_id] 
-        personal_data.pop('Id', None)
-        if personal_record:
-            print("  > Updating Personal Details...")
-            PERSONAL_TABLE.update(personal_record['id'], personal_data)
-        else:
-            print("  > Creating Personal Details...")
-            PERSONAL_TABLE.create(personal_data)
+        tasks.append(upsert_one_to_one(PERSONAL_TABLE, "Personal Details", existing_records["personal"], record_id, personal_data))
 
     # --- 4. SYNC WORK EXPERIENCE (One-to-Many) ---
     experience_data = applicant_data.get("experience", [])
     if experience_data:
-        existing_exp_records = EXPERIENCE_TABLE.all(formula=f"{{Applicant}} = '{applicant_id_to_process}'")
-        if existing_exp_records:
-            record_ids_to_delete = [rec['id'] for rec in existing_exp_records]
-            print(f"  > Deleting {len(record_ids_to_delete)} old Work Experience records...")
-            EXPERIENCE_TABLE.batch_delete(record_ids_to_delete)
-        
-        print(f"  > Creating {len(experience_data)} new Work Experience records...")
-        records_to_create = []
-        for exp in experience_data:
-            exp["Applicant"] = [record_id]
-            exp.pop('Id', None)
-            records_to_create.append(exp)
-        EXPERIENCE_TABLE.batch_create(records_to_create)
+        tasks.append(sync_work_experience(existing_records["experience"], record_id, experience_data))
 
     # --- 5. UPSERT SALARY PREFERENCES (One-to-One) ---
     salary_data = applicant_data.get("salary", {})
     if salary_data:
-        salary_record = SALARY_TABLE.first(formula=f"{{Applicant}} = '{applicant_id_to_process}'")
-        salary_data["Applicant"] = [record_id]
-        salary_data.pop('Id', None)
-        if salary_record:
-            print("  > Updating Salary Preferences...")
-            SALARY_TABLE.update(salary_record['id'], salary_data)
-        else:
-            print("  > Creating Salary Preferences...")
-            SALARY_TABLE.create(salary_data)
+        tasks.append(upsert_one_to_one(SALARY_TABLE, "Salary Preferences", existing_records["salary"], record_id, salary_data))
+
+    await asyncio.gather(*tasks)
 
     print(f"\nSuccessfully decompressed data for Applicant ID: {applicant_id_to_process}")
 
 
+async def process_batch(applicant_ids: list[str], concurrency: int = 5):
+    """Runs decompress_applicant_data over many applicants, at most `concurrency` at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process_one(applicant_id):
+        async with semaphore:
+            try:
+                await decompress_applicant_data(applicant_id)
+            except Exception as e:
+                print(f"An error occurred while decompressing Applicant ID {applicant_id}: {e}")
+
+    await asyncio.gather(*(process_one(applicant_id) for applicant_id in applicant_ids))
+
+
 # --- Example Usage ---
 if __name__ == "__main__":
-    target_applicant_id = "1"
-    decompress_applicant_data(target_applicant_id)
\ No newline at end of file
+    target_applicant_ids = ["1"]
+    asyncio.run(process_batch(target_applicant_ids))
\ No newline at end of file
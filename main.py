@@ -1,62 +1,162 @@
 import os
-import json
-import time # Import the time library for retry logic
+import re
+import asyncio
+import hashlib
+import weakref
 from datetime import datetime
+import numpy as np
+import orjson
+from cachetools import LRUCache, TTLCache
+from diskcache import Cache
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
-from pyairtable import Api
+from pyairtable.formulas import match
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from airtable_client import airtable_call, fetch_applicant_record, get_table
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file, unless already set (airtable_client loads the Airtable keys)
+if not os.getenv("GOOGLE_API_KEY"):
+    load_dotenv()
 
 # --- 1. SETUP ---
-AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
-AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-if not all([AIRTABLE_API_KEY, AIRTABLE_BASE_ID, GOOGLE_API_KEY]):
-    raise ValueError("Airtable keys and Google API Key must be set in the .env file.")
+if not GOOGLE_API_KEY:
+    raise ValueError("Google API Key must be set in the .env file.")
 
-# Configure the Gemini client
+# Configure the Gemini client; one model instance is shared so its transport is reused across calls
 genai.configure(api_key=GOOGLE_API_KEY)
-
-# Configure the Airtable client
-api = Api(AIRTABLE_API_KEY)
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+GEMINI_MODEL = genai.GenerativeModel(GEMINI_MODEL_NAME)
 
 # Define all table connections
-APPLICANTS_TABLE = api.table(AIRTABLE_BASE_ID, "Applicants")
-PERSONAL_TABLE = api.table(AIRTABLE_BASE_ID, "Personal Details")
-EXPERIENCE_TABLE = api.table(AIRTABLE_BASE_ID, "Work Experience")
-SALARY_TABLE = api.table(AIRTABLE_BASE_ID, "Salary Preferences")
-SHORTLISTED_LEADS_TABLE = api.table(AIRTABLE_BASE_ID, "Shortlisted Leads")
+APPLICANTS_TABLE = get_table("Applicants")
+PERSONAL_TABLE = get_table("Personal Details")
+EXPERIENCE_TABLE = get_table("Work Experience")
+SALARY_TABLE = get_table("Salary Preferences")
+SHORTLISTED_LEADS_TABLE = get_table("Shortlisted Leads")
+
+# Stay under the Gemini API quota of 60 requests per minute; one limiter per event loop
+_gemini_rate_limits = weakref.WeakKeyDictionary()
+
+# Only the Applicants fields this script reads; Compressed JSON is written, never read
+APPLICANT_FIELDS = ["LLM Score", "LLM Input Hash"]
+
+# Applicant ID -> Applicants record, so repeat runs and retries skip the formula lookup
+_applicant_cache = TTLCache(maxsize=1024, ttl=60)
+
+# On-disk cache of parsed Gemini evaluations, keyed by the full request (model, settings and prompt)
+# so prompt or config changes never serve stale results; entries expire after 30 days regardless
+LLM_CACHE_EXPIRE_SECONDS = 30 * 24 * 60 * 60
+LLM_CACHE = Cache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache"))
 
 # --- Constants for Shortlisting ---
 TIER_1_COMPANIES = {"google", "meta", "openai", "apple", "amazon", "netflix", "microsoft"}
 APPROVED_LOCATIONS = {"us", "united states", "canada", "uk", "united kingdom", "germany", "india"}
 
+# Approved locations are matched against whole words and word runs (e.g. "united states") of the
+# Location, with punctuation turned into spaces first so "Toronto,Canada" and "U.S." split cleanly
+_LOCATION_ALIASES = {"usa", "u s", "u s a", "u k"}
+_APPROVED_LOCATIONS = frozenset(APPROVED_LOCATIONS | _LOCATION_ALIASES)
+_MAX_LOCATION_WORDS = max(len(loc.split()) for loc in _APPROVED_LOCATIONS)
+_LOCATION_PUNCTUATION = str.maketrans(",.;:()/-", "        ")
+
+# Date string -> parsed date; the same Start/End dates recur across many applicants
+_DATE_CACHE = LRUCache(maxsize=10_000)
+
+# --- Gemini Prompt and Generation Config ---
+_PROMPT_HEADER = """You are a recruiting analyst. Given this JSON applicant profile, do four things:
+1. Provide a concise 75-word summary.
+2. Rate overall candidate quality from 1-10 (higher is better).
+3. List any data gaps or inconsistencies you notice.
+4. Suggest up to three follow-up questions to clarify gaps.
+
+Return your response in exactly this format:
+Summary: <text>
+Score: <integer>
+Issues: <comma-separated list or 'None'>
+Follow-Ups: <bullet list>
+
+Applicant JSON:
+"""
+
+# Token cap for the evaluation response
+GENERATION_SETTINGS = {
+    "max_output_tokens": 500,
+    "temperature": 0.5
+}
+GENERATION_CONFIG = genai.types.GenerationConfig(**GENERATION_SETTINGS)
+
+# Gemini errors worth retrying; anything else fails the evaluation immediately
+GEMINI_MAX_ATTEMPTS = 3
+TRANSIENT_GEMINI_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+# Section headers of the LLM response format requested in _PROMPT_HEADER
+_LLM_SECTION_RE = re.compile(r"^(Summary|Score|Issues|Follow-Ups):(.*)$", re.MULTILINE)
+
 # --- HELPER & AUTOMATION FUNCTIONS ---
 
-def calculate_total_experience(experience_list):
-    """Calculates total years of experience from a list of jobs."""
-    total_months = 0
-    for job in experience_list:
+async def lookup_applicant(applicant_id):
+    """Fetches the Applicants record for an Applicant ID, serving repeats from a short-lived cache."""
+    applicant_record = _applicant_cache.get(applicant_id)
+    if applicant_record is None:
+        applicant_record = await fetch_applicant_record(applicant_id, APPLICANT_FIELDS)
+        if applicant_record:
+            _applicant_cache[applicant_id] = applicant_record
+    return applicant_record
+
+def invalidate_applicant(applicant_id):
+    """Drops a cached Applicants record after it has been written to."""
+    _applicant_cache.pop(applicant_id, None)
+
+def parse_date(date_str):
+    """Parses a YYYY-MM-DD string to datetime64[D] (NaT if invalid), memoized across applicants."""
+    if not isinstance(date_str, str):
+        return np.datetime64("NaT")
+    parsed = _DATE_CACHE.get(date_str)
+    if parsed is None:
         try:
-            start_date = datetime.strptime(job.get("Start"), "%Y-%m-%d")
-            end_date_str = job.get("End")
-            end_date = datetime.strptime(end_date_str, "%Y-%m-%d") if end_date_str else datetime.now()
-            total_months += (end_date.year - start_date.year) * 12 + (end_date.month - start_date.month)
-        except (ValueError, TypeError):
+            # strptime keeps the format strict; numpy alone would also accept "2020", "today", etc.
+            parsed = np.datetime64(datetime.strptime(date_str, "%Y-%m-%d").date(), "D")
+        except ValueError:
+            parsed = np.datetime64("NaT")
+        _DATE_CACHE[date_str] = parsed
+    return parsed
+
+def summarize_experience(experience_list):
+    """Returns total years of experience and whether any job was at a Tier-1 company, in one pass."""
+    today = np.datetime64("today", "D")
+    start_dates, end_dates = [], []
+    worked_at_tier_1 = False
+    for job in experience_list:
+        if not worked_at_tier_1 and job.get("Company", "").lower() in TIER_1_COMPANIES:
+            worked_at_tier_1 = True
+        start_date = parse_date(job.get("Start"))
+        end_date_str = job.get("End")
+        end_date = parse_date(end_date_str) if end_date_str else today
+        if np.isnat(start_date) or np.isnat(end_date):
             continue
-    return total_months / 12
+        start_dates.append(start_date)
+        end_dates.append(end_date)
 
-def evaluate_shortlisting(applicant_record, applicant_json):
+    # Month-precision subtraction over the whole list at once
+    months = np.array(end_dates, dtype="datetime64[M]") - np.array(start_dates, dtype="datetime64[M]")
+    total_months = int(months.astype(np.int64).sum())
+    return total_months / 12, worked_at_tier_1
+
+async def evaluate_shortlisting(applicant_record, applicant_json):
     """Evaluates an applicant's JSON against shortlisting rules."""
     print("  > Evaluating for shortlist...")
     
     # Rule 1: Experience
     experience_list = applicant_json.get("experience", [])
-    total_exp_years = calculate_total_experience(experience_list)
-    worked_at_tier_1 = any(job.get("Company", "").lower() in TIER_1_COMPANIES for job in experience_list)
+    total_exp_years, worked_at_tier_1 = summarize_experience(experience_list)
     experience_ok = (total_exp_years >= 4) or worked_at_tier_1
     
     # Rule 2: Compensation
@@ -67,17 +167,20 @@ def evaluate_shortlisting(applicant_record, applicant_json):
 
     # Rule 3: Location
     personal = applicant_json.get("personal", {})
-    location = personal.get("Location", "").lower()
-    location_ok = any(loc in location for loc in APPROVED_LOCATIONS)
+    location = personal.get("Location", "")
+    words = location.translate(_LOCATION_PUNCTUATION).lower().split()
+    location_ok = not _APPROVED_LOCATIONS.isdisjoint(
+        " ".join(words[i:i + n]) for n in range(1, _MAX_LOCATION_WORDS + 1) for i in range(len(words) - n + 1)
+    )
     
     # Final Decision
     if experience_ok and compensation_ok and location_ok:
         print("  > Applicant meets all criteria. Shortlisting...")
         reason = f"Exp: {total_exp_years:.1f} yrs (Tier-1: {worked_at_tier_1}), Comp: ${rate}/hr @ {availability} hrs/wk, Loc: {personal.get('Location')}"
         
-        SHORTLISTED_LEADS_TABLE.create({
+        await airtable_call(SHORTLISTED_LEADS_TABLE.create, {
             "Applicant": [applicant_record['id']],
-            "Compressed JSON": json.dumps(applicant_json, indent=2),
+            "Compressed JSON": orjson.dumps(applicant_json, option=orjson.OPT_INDENT_2).decode(),
             "Score Reason": reason
         })
         print("  > Successfully created Shortlisted Lead record.")
@@ -87,114 +190,132 @@ def evaluate_shortlisting(applicant_record, applicant_json):
 def parse_llm_response(response_text):
     """Parses the raw text response from the LLM into a dictionary."""
     parsed_data = {}
-    lines = response_text.strip().split('\n')
-    current_section = None
-
-    for line in lines:
-        if line.startswith("Summary:"):
-            parsed_data["LLM Summary"] = line.replace("Summary:", "").strip()
-            current_section = "summary"
-        elif line.startswith("Score:"):
+    response_text = response_text.strip()
+
+    headers = []
+    for header in _LLM_SECTION_RE.finditer(response_text):
+        if header.group(1) == "Score":
             try:
-                parsed_data["LLM Score"] = int(line.replace("Score:", "").strip())
+                parsed_data["LLM Score"] = int(header.group(2).strip())
             except ValueError:
+                # An unparseable Score line is dropped but does not end the current section
                 continue
-            current_section = "score"
-        elif line.startswith("Issues:") or line.startswith("Follow-Ups:"):
-            if "LLM Follow-Ups" not in parsed_data:
-                parsed_data["LLM Follow-Ups"] = ""
-            parsed_data["LLM Follow-Ups"] += line + "\n"
-            current_section = "follow_ups"
-        elif current_section == "follow_ups" and line.strip():
-            parsed_data["LLM Follow-Ups"] += line + "\n"
-            
+        headers.append(header)
+
+    for i, header in enumerate(headers):
+        section = header.group(1)
+        if section == "Summary":
+            parsed_data["LLM Summary"] = header.group(2).strip()
+        elif section in ("Issues", "Follow-Ups"):
+            # Issues / Follow-Ups run until the next section header
+            section_end = headers[i + 1].start() if i + 1 < len(headers) else len(response_text)
+            block = response_text[header.start():section_end]
+            parsed_data["LLM Follow-Ups"] = parsed_data.get("LLM Follow-Ups", "") + "".join(
+                line + "\n" for line in block.splitlines() if line.strip() and not line.startswith("Score:")
+            )
+
     if "LLM Follow-Ups" in parsed_data:
         parsed_data["LLM Follow-Ups"] = parsed_data["LLM Follow-Ups"].strip()
 
     return parsed_data
 
-def evaluate_with_llm(applicant_record, applicant_json):
+def generate_gemini_response(prompt, generation_config):
+    """Requests a Gemini completion and returns its text, keeping partial output from MAX_TOKENS/safety stops."""
+    response = GEMINI_MODEL.generate_content(
+        prompt,
+        generation_config=generation_config
+    )
+    # response.text raises when the candidate has no parts; joining the parts yields "" instead
+    return "".join(part.text for part in response.parts)
+
+def _get_gemini_rate_limit():
+    """Returns the Gemini rate limiter for the running event loop."""
+    loop = asyncio.get_running_loop()
+    rate_limit = _gemini_rate_limits.get(loop)
+    if rate_limit is None:
+        rate_limit = _gemini_rate_limits[loop] = AsyncLimiter(60, 60)
+    return rate_limit
+
+def log_gemini_retry(retry_state):
+    """Reports a transient Gemini failure before tenacity sleeps and retries."""
+    print(f"  > Transient Gemini error (Attempt {retry_state.attempt_number}/{GEMINI_MAX_ATTEMPTS}): {retry_state.outcome.exception()}")
+    print(f"  > Retrying in {retry_state.next_action.sleep:.1f} second(s)...")
+
+@retry(
+    stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+    wait=wait_exponential_jitter(max=8),
+    retry=retry_if_exception_type(TRANSIENT_GEMINI_ERRORS),
+    before_sleep=log_gemini_retry,
+    reraise=True,
+)
+async def call_gemini(prompt):
+    """Gets Gemini's evaluation text, retrying rate-limit and availability errors with jittered backoff."""
+    async with _get_gemini_rate_limit():
+        return await asyncio.to_thread(generate_gemini_response, prompt, GENERATION_CONFIG)
+
+def llm_cache_key(prompt):
+    """Hashes everything that determines a Gemini evaluation: model, generation settings and prompt."""
+    request = {"model": GEMINI_MODEL_NAME, "generation": GENERATION_SETTINGS, "prompt": prompt}
+    return hashlib.blake2b(orjson.dumps(request, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+async def evaluate_with_llm(applicant_record, applicant_json):
     """Sends applicant JSON to Gemini for evaluation, with retries and token caps."""
     print("  > Sending data to Gemini for evaluation...")
     
-    if applicant_record.get('fields', {}).get('LLM Score'):
-        print("  > Applicant already has an LLM score. Skipping.")
+    # Hash of the data being scored, stored on the record so unchanged applicants are skipped
+    input_hash = hashlib.blake2b(orjson.dumps(applicant_json, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+    fields = applicant_record.get('fields', {})
+    if fields.get('LLM Score') and fields.get('LLM Input Hash') == input_hash:
+        print("  > Applicant already has an LLM score for this data. Skipping.")
         return
 
-    # Model name and setup
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    prompt = f"""
-    You are a recruiting analyst. Given this JSON applicant profile, do four things:
-    1. Provide a concise 75-word summary.
-    2. Rate overall candidate quality from 1-10 (higher is better).
-    3. List any data gaps or inconsistencies you notice.
-    4. Suggest up to three follow-up questions to clarify gaps.
-
-    Return your response in exactly this format:
-    Summary: <text>
-    Score: <integer>
-    Issues: <comma-separated list or 'None'>
-    Follow-Ups: <bullet list>
-
-    Applicant JSON:
-    {json.dumps(applicant_json, indent=2)}
-    """
-    
-    # --- Retry and Backoff Logic ---
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # --- Generation Config for Token Cap ---
-            generation_config = genai.types.GenerationConfig(
-                max_output_tokens=500,
-                temperature=0.5
-            )
-            
-            response = model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            
-            response_text = response.text
-            print("  > Gemini response received.")
-            
-            update_data = parse_llm_response(response_text)
-            
-            if update_data:
-                APPLICANTS_TABLE.update(applicant_record['id'], update_data)
-                print("  > Successfully updated applicant record with Gemini evaluation.")
-            
-            return # Exit the function on success
-
-        except Exception as e:
-            print(f"  > An error occurred during Gemini evaluation (Attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt # Exponential backoff: 1, 2, 4 seconds
-                print(f"  > Retrying in {wait_time} second(s)...")
-                time.sleep(wait_time)
-            else:
-                print("  > Max retries reached. LLM evaluation failed.")
+    prompt = _PROMPT_HEADER + orjson.dumps(applicant_json, option=orjson.OPT_INDENT_2).decode()
+
+    cache_key = llm_cache_key(prompt)
+    cached_update = LLM_CACHE.get(cache_key)
+    if cached_update is not None:
+        await airtable_call(APPLICANTS_TABLE.update, applicant_record['id'], cached_update)
+        print("  > Updated applicant record from cached Gemini evaluation.")
+        return
+
+    try:
+        response_text = await call_gemini(prompt)
+    except Exception as e:
+        print(f"  > An error occurred during Gemini evaluation: {e}")
+        print("  > LLM evaluation failed.")
+        return
+    print("  > Gemini response received.")
+
+    update_data = parse_llm_response(response_text)
+
+    if update_data:
+        update_data["LLM Input Hash"] = input_hash
+        await airtable_call(APPLICANTS_TABLE.update, applicant_record['id'], update_data)
+        LLM_CACHE.set(cache_key, update_data, expire=LLM_CACHE_EXPIRE_SECONDS)
+        print("  > Successfully updated applicant record with Gemini evaluation.")
 
 # --- MAIN ORCHESTRATION FUNCTION ---
 
-def compress_evaluate_enrich(applicant_id_to_process: str):
+async def compress_evaluate_enrich(applicant_id_to_process: str):
     """Main function to compress data, then evaluate it for shortlisting and LLM enrichment."""
     print(f"Processing Applicant ID: {applicant_id_to_process}...")
     try:
         # 1. Fetch main applicant record
-        formula = f"{{Applicant ID}} = '{applicant_id_to_process}'"
-        applicant_record = APPLICANTS_TABLE.first(formula=formula)
+        applicant_record = await lookup_applicant(applicant_id_to_process)
         if not applicant_record:
             print(f"Error: Applicant with ID '{applicant_id_to_process}' not found.")
             return
 
         record_id = applicant_record['id']
         
-        # 2. Fetch all child records
-        personal_details = PERSONAL_TABLE.first(formula=f"{{Applicant}} = '{applicant_id_to_process}'")
-        work_experiences = EXPERIENCE_TABLE.all(formula=f"{{Applicant}} = '{applicant_id_to_process}'")
-        salary_prefs = SALARY_TABLE.first(formula=f"{{Applicant}} = '{applicant_id_to_process}'")
+        # 2. Fetch all child records (independent lookups, so issue them concurrently)
+        child_formula = match({"Applicant": applicant_id_to_process})
+        personal_details, work_experiences, salary_prefs = await asyncio.gather(
+            airtable_call(PERSONAL_TABLE.first, formula=child_formula),
+            airtable_call(EXPERIENCE_TABLE.all, formula=child_formula),
+            airtable_call(SALARY_TABLE.first, formula=child_formula),
+        )
         
         # 3. Build the complete JSON object
         personal_data = personal_details.get('fields', {}) if personal_details else {}
@@ -217,19 +338,30 @@ def compress_evaluate_enrich(applicant_id_to_process: str):
         }
         
         # 4. Write the compressed JSON back to Airtable
-        APPLICANTS_TABLE.update(record_id, {"Compressed JSON": json.dumps(final_json, indent=2)})
+        await airtable_call(APPLICANTS_TABLE.update, record_id, {"Compressed JSON": orjson.dumps(final_json, option=orjson.OPT_INDENT_2).decode()})
+        invalidate_applicant(applicant_id_to_process)
         print(f"  > Successfully compressed data for Applicant ID: {applicant_id_to_process}")
 
         # 5. Run the shortlisting evaluation
-        evaluate_shortlisting(applicant_record, final_json)
+        await evaluate_shortlisting(applicant_record, final_json)
         
         # 6. Run the LLM enrichment
-        evaluate_with_llm(applicant_record, final_json)
+        await evaluate_with_llm(applicant_record, final_json)
 
     except Exception as e:
         print(f"An error occurred: {e}")
 
+async def process_batch(applicant_ids: list[str], concurrency: int = 5):
+    """Runs compress_evaluate_enrich over many applicants, at most `concurrency` at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process_one(applicant_id):
+        async with semaphore:
+            await compress_evaluate_enrich(applicant_id)
+
+    await asyncio.gather(*(process_one(applicant_id) for applicant_id in applicant_ids))
+
 # --- SCRIPT EXECUTION ---
 if __name__ == "__main__":
-    target_applicant_id = "4" 
-    compress_evaluate_enrich(target_applicant_id)
\ No newline at end of file
+    target_applicant_ids = ["4"]
+    asyncio.run(process_batch(target_applicant_ids))
\ No newline at end of file